@@ -25,7 +25,6 @@ import ldscore.sumstats as sumstats
 import ldscore.regressions as reg
 import numpy as np
 import pandas as pd
-from subprocess import call
 from itertools import product
 import time, sys, traceback, argparse
 
@@ -349,18 +348,24 @@ def ldscore(args, log):
                         F=args.print_snps, N=len(print_snps)))
 
         print_snps.columns=['SNP']
-        df = df.ix[df.SNP.isin(print_snps.SNP),:]
+        df = df[df.SNP.isin(print_snps.SNP)]
         if len(df) == 0:
             raise ValueError('After merging with --print-snps, no SNPs remain.')
         else:
             msg = 'After merging with --print-snps, LD Scores for {N} SNPs will be printed.'
             log.log(msg.format(N=len(df)))
 
-    l2_suffix = '.gz'
-    log.log("Writing LD Scores for {N} SNPs to {f}.gz".format(f=out_fname, N=len(df)))
-    df.drop(['CM','MAF'], axis=1).to_csv(out_fname, sep="\t", header=True, index=False,
-        float_format='%.3f')
-    call(['gzip', '-f', out_fname])
+    l2_suffix = '.pickle.gz' if args.pickle else '.gz'
+    log.log("Writing LD Scores for {N} SNPs to {f}".format(f=out_fname + l2_suffix, N=len(df)))
+    out_df = df.drop(['CM','MAF'], axis=1)
+    if args.pickle:
+        # np.c_ leaves every column as object; use the dtypes a read of the text output would give
+        dtypes = {c: array_snps.df[c].dtype for c in ['CHR', 'BP']}
+        dtypes.update({c: float for c in ldscore_colnames})
+        out_df.reset_index(drop=True).astype(dtypes).to_pickle(out_fname + l2_suffix)
+    else:
+        ps.write_gzip_csv(out_df, out_fname + l2_suffix, sep="\t", header=True, index=False,
+            float_format='%.3f')
     if annot_matrix is not None:
         M = np.atleast_1d(np.squeeze(np.asarray(np.sum(annot_matrix, axis=0))))
         ii = geno_array.maf > 0.05
@@ -387,14 +392,13 @@ def ldscore(args, log):
         annot_df.columns = new_colnames
         del annot_df['MAF']
         log.log("Writing annot matrix produced by --cts-bin to {F}".format(F=out_fname+'.gz'))
-        annot_df.to_csv(out_fname_annot, sep="\t", header=True, index=False)
-        call(['gzip', '-f', out_fname_annot])
+        ps.write_gzip_csv(annot_df, out_fname_annot + '.gz', sep="\t", header=True, index=False)
 
     # print LD Score summary
     pd.set_option('display.max_rows', 200)
     log.log('\nSummary of LD Scores in {F}'.format(F=out_fname+l2_suffix))
-    t = df.ix[:,4:].describe()
-    log.log( t.ix[1:,:] )
+    t = df.iloc[:,4:].describe()
+    log.log( t.iloc[1:,:] )
 
     np.seterr(divide='ignore', invalid='ignore')  # print NaN instead of weird errors
 
@@ -571,7 +575,9 @@ parser.add_argument('--print-delete-vals', default=False, action='store_true',
 parser.add_argument('--chunk-size', default=50, type=int,
     help='Chunk size for LD Score calculation. Use the default.')
 parser.add_argument('--pickle', default=False, action='store_true',
-    help='Store .l2.ldscore files as pickles instead of gzipped tab-delimited text.')
+    help='Store .l2.ldscore files as gzipped pickles instead of gzipped tab-delimited text. '
+    'With --h2 or --rg, read .l2.ldscore.pickle.gz files for --ref-ld and --w-ld. Only use '
+    'this with pickles you wrote yourself; unpickling a file can run arbitrary code.')
 parser.add_argument('--yes-really', default=False, action='store_true',
     help='Yes, I really want to compute whole-chromosome LD Score.')
 parser.add_argument('--invert-anyway', default=False, action='store_true',
@@ -9,6 +9,10 @@ from __future__ import division
 import numpy as np
 import pandas as pd
 import os
+import io
+import gzip
+import subprocess
+from distutils.spawn import find_executable
 
 
 def series_eq(x, y):
@@ -57,6 +61,30 @@ def get_compression(fh):
     return compression
 
 
+def write_gzip_csv(df, fh, **kwargs):
+    '''Write df to the gzipped text file fh with to_csv, compressing as it is written.'''
+    pigz = find_executable('pigz')
+    if pigz is not None:
+        # multi-threaded deflate in a separate process, running alongside to_csv
+        with open(fh, 'wb') as f:
+            p = subprocess.Popen([pigz, '-6', '-c'], stdin=subprocess.PIPE, stdout=f,
+                                 bufsize=1 << 20)
+            try:
+                df.to_csv(p.stdin, **kwargs)
+            finally:
+                p.stdin.close()
+                returncode = p.wait()
+
+        if returncode != 0:
+            raise IOError('pigz exited with status {S} while writing {F}'.format(S=returncode, F=fh))
+    else:
+        with gzip.open(fh, 'wb', compresslevel=6) as f:
+            # batch the small row writes from to_csv before they reach zlib
+            buf = io.BufferedWriter(f, buffer_size=1 << 20)
+            df.to_csv(buf, **kwargs)
+            buf.flush()
+
+
 def read_cts(fh, match_snps):
     '''Reads files for --cts-bin.'''
     compression = get_compression(fh)
@@ -86,11 +114,11 @@ def sumstats(fh, alleles=False, dropna=True):
     return x
 
 
-def ldscore_fromlist(flist, num=None):
+def ldscore_fromlist(flist, num=None, pickle=False):
     '''Sideways concatenation of a list of LD Score files.'''
     ldscore_array = []
     for i, fh in enumerate(flist):
-        y = ldscore(fh, num)
+        y = ldscore(fh, num, pickle=pickle)
         if i > 0:
             if not series_eq(y.SNP, ldscore_array[0].SNP):
                 raise ValueError('LD Scores for concatenation must have identical SNP columns.')
@@ -104,9 +132,27 @@ def ldscore_fromlist(flist, num=None):
     return pd.concat(ldscore_array, axis=1)
 
 
+def which_compression_l2(fh, pickle=False):
+    '''
+    which_compression, plus the gzipped pickles written by ldsc.py --l2 --pickle. Unpickling
+    can run arbitrary code, so pickles are only read when asked for with pickle=True.
+    '''
+    if pickle and os.access(fh + '.pickle.gz', 4):
+        return '.pickle.gz', 'pickle'
+    try:
+        return which_compression(fh)
+    except IOError:
+        if os.access(fh + '.pickle.gz', 4):
+            raise IOError('Could not open {F}[./gz/bz2]. Use --pickle to read {F}.pickle.gz'.format(F=fh))
+        raise
+
+
 def l2_parser(fh, compression):
     '''Parse LD Score files'''
-    x = read_csv(fh, header=0, compression=compression)
+    if compression == 'pickle':
+        x = pd.read_pickle(fh)
+    else:
+        x = read_csv(fh, header=0, compression=compression)
     if 'MAF' in x.columns and 'CM' in x.columns:  # for backwards compatibility w/ v<1.0.0
         x = x.drop(['MAF', 'CM'], axis=1)
     return x
@@ -129,16 +175,19 @@ def frq_parser(fh, compression):
     return df[['SNP', 'FRQ']]
 
 
-def ldscore(fh, num=None):
-    '''Parse .l2.ldscore files, split across num chromosomes. See docs/file_formats_ld.txt.'''
+def ldscore(fh, num=None, pickle=False):
+    '''
+    Parse .l2.ldscore files, split across num chromosomes. See docs/file_formats_ld.txt.
+    With pickle=True, .l2.ldscore.pickle.gz files written by ldsc.py --l2 --pickle are read too.
+    '''
     suffix = '.l2.ldscore'
     if num is not None:  # num files, e.g., one per chromosome
         first_fh = sub_chr(fh, 1) + suffix
-        s, compression = which_compression(first_fh)
+        s, compression = which_compression_l2(first_fh, pickle)
         chr_ld = [l2_parser(sub_chr(fh, i) + suffix + s, compression) for i in xrange(1, num + 1)]
         x = pd.concat(chr_ld)  # automatically sorted by chromosome
     else:  # just one file
-        s, compression = which_compression(fh + suffix)
+        s, compression = which_compression_l2(fh + suffix, pickle)
         x = l2_parser(fh + suffix + s, compression)
 
     x = x.sort_values(by=['CHR', 'BP']) # SEs will be wrong unless sorted
@@ -17,7 +17,7 @@ from scipy.stats import t as tdist
 from collections import namedtuple
 np.seterr(divide='raise', invalid='raise')
 
-s = lambda x: remove_brackets(str(np.matrix(x)))
+s = lambda x: remove_brackets(str(np.atleast_2d(x)))
 
 
 def update_separators(s, ii):
@@ -79,7 +79,8 @@ def smart_merge(x, y):
 def _read_ref_ld(args, log):
     '''Read reference LD Scores.'''
     ref_ld = _read_chr_split_files(args.ref_ld_chr, args.ref_ld, log,
-                                   'reference panel LD Score', ps.ldscore_fromlist)
+                                   'reference panel LD Score', ps.ldscore_fromlist,
+                                   pickle=args.pickle)
     log.log(
         'Read reference panel LD Scores for {N} SNPs.'.format(N=len(ref_ld)))
     return ref_ld
@@ -131,7 +132,8 @@ def _read_w_ld(args, log):
         raise ValueError(
             '--w-ld must point to a single fileset (no commas allowed).')
     w_ld = _read_chr_split_files(args.w_ld_chr, args.w_ld, log,
-                                 'regression weight LD Score', ps.ldscore_fromlist)
+                                 'regression weight LD Score', ps.ldscore_fromlist,
+                                 pickle=args.pickle)
     if len(w_ld.columns) != 2:
         raise ValueError('--w-ld may only have one LD Score column.')
     w_ld.columns = ['SNP', 'LD_weights']  # prevent colname conflicts w/ ref ld
@@ -189,14 +191,14 @@ def _check_ld_condnum(args, log, ref_ld):
 
 def _check_variance(log, M_annot, ref_ld):
     '''Remove zero-variance LD Scores.'''
-    ii = ref_ld.ix[:, 1:].var() == 0  # NB there is a SNP column here
+    ii = ref_ld.iloc[:, 1:].var() == 0  # NB there is a SNP column here
     if ii.all():
         raise ValueError('All LD Scores have zero variance.')
     else:
         log.log('Removing partitioned LD Scores with zero variance.')
         ii_snp = np.array([True] + list(~ii))
         ii_m = np.array(~ii)
-        ref_ld = ref_ld.ix[:, ii_snp]
+        ref_ld = ref_ld.loc[:, ii_snp]
         M_annot = M_annot[:, ii_m]
 
     return M_annot, ref_ld, ii
@@ -272,7 +274,7 @@ def cell_type_specific(args, log):
         chisq_max = args.chisq_max
 
     ii = np.ravel(sumstats.Z**2 < chisq_max)
-    sumstats = sumstats.ix[ii, :]
+    sumstats = sumstats[ii]
     log.log('Removed {M} SNPs with chi^2 > {C} ({N} SNPs remain)'.format(
             C=chisq_max, N=np.sum(ii), M=n_snp-np.sum(ii)))
     n_snp = np.sum(ii)  # lambdas are late-binding, so this works
@@ -289,10 +291,11 @@ def cell_type_specific(args, log):
         try:
             (name, ct_ld_chr) = cts_line.split() # whitespace delim file with ONLY two cols. Statement raises exception 'ValueError: too many values to unpack (expected 2)' if .split() gives more string splits.
             ref_ld_cts_allsnps = _read_chr_split_files(ct_ld_chr, None, log,
-                                       'cts reference panel LD Score', ps.ldscore_fromlist)
+                                       'cts reference panel LD Score', ps.ldscore_fromlist,
+                                       pickle=args.pickle)
             log.log('Performing regression #{}/#{}. CTS name is {}'.format(cts_linenum, len(cts_lines), name)) # PT MODIFIED.
             sys.stdout.flush() # PT ADDED
-            ref_ld_cts = np.array(pd.merge(keep_snps, ref_ld_cts_allsnps, on='SNP', how='left').ix[:,1:])
+            ref_ld_cts = np.array(pd.merge(keep_snps, ref_ld_cts_allsnps, on='SNP', how='left').iloc[:,1:])
             if np.any(np.isnan(ref_ld_cts)):
                 raise ValueError ('Missing some LD scores from cts files. Are you sure all SNPs in ref-ld-chr are also in ref-ld-chr-cts')
 
@@ -354,7 +357,7 @@ def estimate_h2(args, log):
     chisq = s(sumstats.Z**2)
     if chisq_max is not None:
         ii = np.ravel(chisq < chisq_max)
-        sumstats = sumstats.ix[ii, :]
+        sumstats = sumstats[ii]
         log.log('Removed {M} SNPs with chi^2 > {C} ({N} SNPs remain)'.format(
                 C=chisq_max, N=np.sum(ii), M=n_snp-np.sum(ii)))
         n_snp = np.sum(ii)  # lambdas are late-binding, so this works
@@ -513,18 +516,19 @@ def _merge_sumstats_sumstats(args, sumstats1, sumstats2, log):
 
 def _filter_alleles(alleles):
     '''Remove bad variants (mismatched alleles, non-SNPs, strand ambiguous).'''
-    ii = alleles.apply(lambda y: y in MATCH_ALLELES)
+    ii = alleles.isin(MATCH_ALLELES)
     return ii
 
 
 def _align_alleles(z, alleles):
     '''Align Z1 and Z2 to same choice of ref allele (allowing for strand flip).'''
-    try:
-        z *= (-1) ** alleles.apply(lambda y: FLIP_ALLELES[y])
-    except KeyError as e:
-        msg = 'Incompatible alleles in .sumstats files: %s. ' % e.args
+    flip = alleles.map(FLIP_ALLELES)
+    missing = flip.isnull().values
+    if missing.any():
+        msg = 'Incompatible alleles in .sumstats files: %s. ' % alleles[missing].iloc[0]
         msg += 'Did you forget to use --merge-alleles with munge_sumstats.py?'
         raise KeyError(msg)
+    z *= np.where(flip.values.astype(bool), -1, 1)
     return z
 
 
@@ -5,12 +5,13 @@ from __future__ import absolute_import
 from lib_mtag_munge import allele_info as allele_info # Timshel
 import pandas as pd
 import numpy as np
-import os
 import sys
+import io
 import traceback
 import gzip
 import bz2
 import argparse
+from scipy.special import ndtri
 from scipy.stats import chi2
 import logging
 import time
@@ -287,8 +288,10 @@ describe_cname = {
 def read_header(fh):
     '''Read the first line of a file and returns a list with the column names.'''
     (openfunc, compression) = get_compression(fh)
+    with openfunc(fh) as f:
+        header = f.readline()
 
-    return [x.rstrip('\n') for x in openfunc(fh).readline().split()]
+    return [x.rstrip('\n') for x in header.split()]
 
 
 def get_cname_map(flag, default, ignore):
@@ -304,10 +307,11 @@ def get_cname_map(flag, default, ignore):
     are cleaned. But all equality is modulo clean_header().
 
     '''
-    clean_ignore = [clean_header(x) for x in ignore]
+    clean_ignore = set(clean_header(x) for x in ignore)
     cname_map = {x: flag[x] for x in flag if x not in clean_ignore}
+    skip = clean_ignore.union(flag)
     cname_map.update(
-        {x: default[x] for x in default if x not in clean_ignore + list(flag.keys())})
+        {x: default[x] for x in default if x not in skip})
     return cname_map
 
 
@@ -410,6 +414,10 @@ def parse_dat(dat_gen, convert_colname, merge_alleles, args):
     logging.info(msg.format(F=args.sumstats if args.sumstats is not None else 'provided DataFrame', N=int(args.chunksize)))
     drops = {'NA': 0, 'P': 0, 'INFO': 0,
              'FRQ': 0, 'A': 0, 'SNP': 0, 'MERGE': 0, 'SE': 0}
+    if args.merge_alleles:
+        # hash the --merge-alleles SNPs once rather than once per chunk
+        merge_snps = pd.Index(merge_alleles.SNP.unique())
+
     for block_num, dat in enumerate(dat_gen):
         tot_snps += len(dat)
         old = len(dat)
@@ -417,17 +425,17 @@ def parse_dat(dat_gen, convert_colname, merge_alleles, args):
         #dat = dat.dropna(axis=0, how="any", subset=filter(
         #    lambda x: x != 'INFO', dat.columns)).reset_index(drop=True)
         drops['NA'] += old - len(dat)
-        dat.columns = map(lambda x: convert_colname[x], dat.columns)
-        ii = np.array([True for i in range(len(dat))])
+        dat.columns = [convert_colname[x] for x in dat.columns]
+        ii = np.ones(len(dat), dtype=bool)
         if args.merge_alleles:
             old = ii.sum()
-            ii = dat.SNP.isin(merge_alleles.SNP)
+            ii = merge_snps.get_indexer(dat.SNP.values) >= 0
             drops['MERGE'] += old - ii.sum()
             if ii.sum() == 0:
                 continue
 
             dat = dat[ii].reset_index(drop=True)
-            ii = np.array([True for i in range(len(dat))])
+            ii = np.ones(len(dat), dtype=bool)
 
         if 'INFO' in dat.columns:
             old = ii.sum()
@@ -472,9 +480,9 @@ def parse_dat(dat_gen, convert_colname, merge_alleles, args):
         if ii.sum() == 0:
             continue
 
-        dat_list.append(dat[ii].reset_index(drop=True))
+        dat_list.append(dat[ii])
 
-    dat = pd.concat(dat_list, axis=0).reset_index(drop=True)
+    dat = pd.concat(dat_list, axis=0, ignore_index=True)
     msg = 'Read {N} SNPs from --sumstats file.\n'.format(N=tot_snps)
     if args.merge_alleles:
         msg += 'Removed {N} SNPs not in --merge-alleles.\n'.format(
@@ -499,14 +507,14 @@ def parse_dat(dat_gen, convert_colname, merge_alleles, args):
 def process_n(dat, args):
     '''Determine sample size from --N* flags or N* columns. Filter out low N SNPs.s'''
     if all(i in dat.columns for i in ['N_CAS', 'N_CON']):
-        N = dat.N_CAS + dat.N_CON
-        P = dat.N_CAS / N
-        dat['N'] = N * P / P[N == N.max()].mean()
+        N = (dat.N_CAS.values + dat.N_CON.values).astype(float)
+        P = dat.N_CAS.values / N
+        dat['N'] = N * P / P[N == np.nanmax(N)].mean()
         dat.drop(['N_CAS', 'N_CON'], inplace=True, axis=1)
         # NB no filtering on N done here -- that is done in the next code block
 
     if 'N' in dat.columns:
-        n_min = args.n_min if args.n_min or args.n_min==0 else dat.N.quantile(0.9) / 1.5
+        n_min = args.n_min if args.n_min or args.n_min==0 else np.nanpercentile(dat.N.values, 90) / 1.5
         old = len(dat)
         dat = dat[dat.N >= n_min].reset_index(drop=True)
         new = len(dat)
@@ -540,7 +548,14 @@ def process_n(dat, args):
 
 def p_to_z(P, N):
     '''Convert P-value and N to standardized beta.'''
-    return np.sqrt(chi2.isf(P, 1))
+    # sqrt(chi2.isf(P, 1)) == |Z| where P = 2 * Phi(-|Z|), but ndtri is much faster.
+    # P / 2 underflows for subnormal P, so those few fall back to chi2.isf.
+    P = np.asarray(P, dtype=float)
+    Z = np.abs(ndtri(P / 2))
+    tiny = P < np.finfo(float).tiny
+    if tiny.any():
+        Z[tiny] = np.sqrt(chi2.isf(P[tiny], 1))
+    return Z
 
 
 def check_median(x, expected_median, tolerance, name):
@@ -604,15 +619,18 @@ def allele_merge(dat, alleles):
     WARNING: dat now contains a bunch of NA's~
     Note: dat now has the same SNPs in the same order as --merge alleles.
     '''
-    dat = pd.merge(
-        alleles, dat, how='left', on='SNP', sort=False).reset_index(drop=True)
-    ii = dat.A1.notnull()
+    # SNP is unique in dat after drop_duplicates, so a reindex against the
+    # --merge-alleles order gives the same result as a left merge while hashing
+    # only the sumstats SNPs
+    dat = dat.set_index('SNP').reindex(alleles.SNP).reset_index()
+    dat.insert(1, 'MA', alleles.MA.values)
+    ii = dat.A1.notnull().values
     a1234 = dat.A1[ii] + dat.A2[ii] + dat.MA[ii]
-    match = a1234.apply(lambda y: y in allele_info.MATCH_ALLELES)
-    jj = pd.Series(np.zeros(len(dat), dtype=bool))
+    match = a1234.isin(allele_info.MATCH_ALLELES).values
+    jj = np.zeros(len(dat), dtype=bool)
     jj[ii] = match
-    old = ii.sum()
-    n_mismatch = (~match).sum()
+    old = np.count_nonzero(ii)
+    n_mismatch = old - np.count_nonzero(match)
     if n_mismatch < old:
         logging.info('Removed {M} SNPs whose alleles did not match --merge-alleles ({N} SNPs remain).'.format(M=n_mismatch,N=old - n_mismatch))
     else:
@@ -767,8 +785,8 @@ def munge_sumstats(args, write_out=True, new_log=True):
         cname_map = get_cname_map(
             flag_cnames, mod_default_cnames, ignore_cnames)
         if args.daner:
-            frq_u = filter(lambda x: x.startswith('FRQ_U_'), file_cnames)[0]
-            frq_a = filter(lambda x: x.startswith('FRQ_A_'), file_cnames)[0]
+            frq_u = [x for x in file_cnames if x.startswith('FRQ_U_')][0]
+            frq_a = [x for x in file_cnames if x.startswith('FRQ_A_')][0]
             N_cas = float(frq_a[6:])
             N_con = float(frq_u[6:])
             logging.info(
@@ -783,7 +801,7 @@ def munge_sumstats(args, write_out=True, new_log=True):
             cname_map[frq_u] = 'FRQ'
 
         if args.daner_n:
-            frq_u = filter(lambda x: x.startswith('FRQ_U_'), file_cnames)[0]
+            frq_u = [x for x in file_cnames if x.startswith('FRQ_U_')][0]
             cname_map[frq_u] = 'FRQ'
             try:
                 dan_cas = clean_header(file_cnames[file_cnames.index('Nca')])
@@ -798,8 +816,9 @@ def munge_sumstats(args, write_out=True, new_log=True):
                 cname_map[dan_cas] = 'N_CAS'
             cname_map[dan_con] = 'N_CON'
 
-        cname_translation = {x: cname_map[clean_header(x)] for x in file_cnames if
-                             clean_header(x) in cname_map}  # note keys not cleaned
+        clean_file_cnames = {x: clean_header(x) for x in file_cnames}
+        cname_translation = {x: cname_map[clean_file_cnames[x]] for x in file_cnames if
+                             clean_file_cnames[x] in cname_map}  # note keys not cleaned
         cname_description = {
             x: describe_cname[cname_translation[x]] for x in cname_translation}
         if args.signed_sumstats is None and not args.a1_inc:
@@ -869,7 +888,7 @@ def munge_sumstats(args, write_out=True, new_log=True):
             logging.info(
                 'Read {N} SNPs for allele merge.'.format(N=len(merge_alleles)))
             merge_alleles['MA'] = (
-                merge_alleles.A1 + merge_alleles.A2).apply(lambda y: y.upper())
+                merge_alleles.A1 + merge_alleles.A2).str.upper()
             merge_alleles.drop(
                 [x for x in merge_alleles.columns if x not in ['SNP', 'MA']], axis=1, inplace=True)
         else:
@@ -879,7 +898,7 @@ def munge_sumstats(args, write_out=True, new_log=True):
         # they're read as floats
         signed_sumstat_cols = [k for k,v in cname_translation.items() if v=='SIGNED_SUMSTAT']
         if args.input_datgen is not None:
-            dat_gen = [sub_df[list(cname_translation.keys())] for sub_df in args.input_datgen]
+            dat_gen = (sub_df[list(cname_translation.keys())] for sub_df in args.input_datgen)
 
         else:
             (openfunc, compression) = get_compression(args.sumstats)
@@ -887,7 +906,6 @@ def munge_sumstats(args, write_out=True, new_log=True):
                 compression=compression, usecols=cname_translation.keys(),
                 na_values=['.', 'NA','NaN'], iterator=True, chunksize=args.chunksize,
                 dtype={c:np.float64 for c in signed_sumstat_cols})
-            dat_gen = list(dat_gen)
 
         dat = parse_dat(dat_gen, cname_translation, merge_alleles, args)
         if len(dat) == 0:
@@ -908,7 +926,8 @@ def munge_sumstats(args, write_out=True, new_log=True):
         if not args.a1_inc:
             logging.info(
                 check_median(dat.SIGNED_SUMSTAT, signed_sumstat_null, 0.1, sign_cname))
-            dat.Z *= (-1) ** (dat.SIGNED_SUMSTAT < signed_sumstat_null)
+            flip = dat.SIGNED_SUMSTAT.values < signed_sumstat_null
+            dat.Z = np.where(flip, -dat.Z.values, dat.Z.values)
             #dat.drop('SIGNED_SUMSTAT', inplace=True, axis=1)
         # do this last so we don't have to worry about NA values in the rest of
         # the program
@@ -928,31 +947,48 @@ def munge_sumstats(args, write_out=True, new_log=True):
             print_colnames.append('SE')
         if args.keep_pval:
             print_colnames.append('PVAL')
+        # SNPs left blank by --merge-alleles are dropped once, for both the output and the metadata;
+        # without --merge-alleles nothing is dropped and the frame need not be copied
+        ii = dat.N.notnull().values
+        if not ii.all():
+            dat = dat[ii]
         if write_out:
             out_fname = args.out + '.sumstats'
-            dat=dat[dat.N.notnull()] # added
             msg = 'Writing summary statistics for {M} SNPs ({N} with nonmissing N) to {F}.'
             logging.info(
-            msg.format(M=len(dat), F=out_fname + '.gz', N=dat.N.notnull().sum()))
-            dat.to_csv(out_fname, sep="\t", index=False,
-                       columns=print_colnames) # float_format='%.10f'
-            
-            os.system('gzip -f {F}'.format(F=out_fname))
+            msg.format(M=len(dat), F=out_fname + '.gz', N=len(dat)))
+            # compress while writing instead of gzipping the text file afterwards; the
+            # buffer batches the small row writes from to_csv before they reach zlib.
+            # This is the gzip branch of ldscore.parse.write_gzip_csv, left without the
+            # pigz pipe on purpose because this script only depends on lib_mtag_munge
+            with gzip.open(out_fname + '.gz', 'wb', compresslevel=6) as f:
+                buf = io.BufferedWriter(f, buffer_size=1 << 20)
+                dat.to_csv(buf, sep="\t", index=False,
+                           columns=print_colnames) # float_format='%.10f'
+                buf.flush()
         logging.info('Dropping snps with null values')
-        dat = dat[dat.N.notnull()]
         logging.info('\nMetadata:')
-        dat = dat[dat.N.notnull()]
        
-        CHISQ = np.square(dat.Z) # ** 2)
-        mean_chisq = CHISQ.mean()
+        CHISQ = np.square(dat.Z.values) # ** 2)
+        CHISQ = CHISQ[~np.isnan(CHISQ)]
+        n = len(CHISQ)
+        # with no SNPs left every summary is nan, as it was for the empty Series
+        mean_chisq = CHISQ.mean() if n > 0 else float('nan')
      
         logging.info('Mean chi^2 = ' + str(round(mean_chisq, 3)))
         if mean_chisq < 1.02:
             logging.info("WARNING: mean chi^2 may be too small.")
 
-        logging.info('Lambda GC = ' + str(round(CHISQ.median() / 0.4549, 3)))
-        logging.info('Max chi^2 = ' + str(round(CHISQ.max(), 3)))
-        logging.info('{N} Genome-wide significant SNPs (some may have been removed by filtering).'.format(N=(CHISQ > 29).sum()))
+        if n > 0:
+            # a single selection gives both middle order statistics and the maximum
+            CHISQ = np.partition(CHISQ, [(n - 1) // 2, n // 2, n - 1])
+            median_chisq = (CHISQ[(n - 1) // 2] + CHISQ[n // 2]) / 2
+            max_chisq = CHISQ[n - 1]
+        else:
+            median_chisq = max_chisq = float('nan')
+        logging.info('Lambda GC = ' + str(round(median_chisq / 0.4549, 3)))
+        logging.info('Max chi^2 = ' + str(round(max_chisq, 3)))
+        logging.info('{N} Genome-wide significant SNPs (some may have been removed by filtering).'.format(N=np.count_nonzero(CHISQ > 29)))
         return dat
 
     except Exception:
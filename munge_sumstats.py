@@ -7,14 +7,15 @@
 from __future__ import division
 import pandas as pd
 import numpy as np
-import os
 import sys
 import traceback
 import gzip
 import bz2
 import argparse
+from scipy.special import ndtri
 from scipy.stats import chi2
 from ldscore import sumstats
+from ldscore import parse as ps
 from ldsc import MASTHEAD, Logger, sec_to_str
 import time
 np.seterr(invalid='ignore')
@@ -129,10 +130,26 @@ describe_cname = {
 
 numeric_cols = ['P', 'N', 'N_CAS', 'N_CON', 'Z', 'OR', 'BETA', 'LOG_ODDS', 'INFO', 'FRQ', 'SIGNED_SUMSTAT', 'NSTUDY']
 
+
+def _valid_snps_lut():
+    '''sumstats.VALID_SNPS as a lookup table indexed by the byte values of (A1, A2), in either case.'''
+    lut = np.zeros((256, 256), dtype=bool)
+    for x in sumstats.VALID_SNPS:
+        for a1 in [x[0], x[0].lower()]:
+            for a2 in [x[1], x[1].lower()]:
+                lut[ord(a1), ord(a2)] = True
+    return lut
+
+VALID_SNPS_LUT = _valid_snps_lut()
+
+
 def read_header(fh):
     '''Read the first line of a file and returns a list with the column names.'''
     (openfunc, compression) = get_compression(fh)
-    return [x.rstrip('\n') for x in openfunc(fh).readline().split()]
+    with openfunc(fh) as f:
+        header = f.readline()
+
+    return [x.rstrip('\n') for x in header.split()]
 
 
 def get_cname_map(flag, default, ignore):
@@ -148,10 +165,11 @@ def get_cname_map(flag, default, ignore):
     are cleaned. But all equality is modulo clean_header().
 
     '''
-    clean_ignore = [clean_header(x) for x in ignore]
+    clean_ignore = set(clean_header(x) for x in ignore)
     cname_map = {x: flag[x] for x in flag if x not in clean_ignore}
+    skip = clean_ignore.union(flag)
     cname_map.update(
-        {x: default[x] for x in default if x not in clean_ignore + flag.keys()})
+        {x: default[x] for x in default if x not in skip})
     return cname_map
 
 
@@ -185,53 +203,61 @@ def clean_header(header):
 
 def filter_pvals(P, log, args):
     '''Remove out-of-bounds P-values'''
-    ii = (P > 0) & (P <= 1)
-    bad_p = (~ii).sum()
+    p = P.values
+    ii = (p > 0) & (p <= 1)
+    bad_p = len(ii) - np.count_nonzero(ii)
     if bad_p > 0:
         msg = 'WARNING: {N} SNPs had P outside of (0,1]. The P column may be mislabeled.'
         log.log(msg.format(N=bad_p))
 
-    return ii
+    return pd.Series(ii, index=P.index)
 
 
 def filter_info(info, log, args):
     '''Remove INFO < args.info_min (default 0.9) and complain about out-of-bounds INFO.'''
     if type(info) is pd.Series:  # one INFO column
-        jj = ((info > 2.0) | (info < 0)) & info.notnull()
-        ii = info >= args.info_min
+        x = info.values[:, np.newaxis]
     elif type(info) is pd.DataFrame:  # several INFO columns
-        jj = (((info > 2.0) & info.notnull()).any(axis=1) | (
-            (info < 0) & info.notnull()).any(axis=1))
-        ii = (info.sum(axis=1) >= args.info_min * (len(info.columns)))
+        x = info.values
     else:
         raise ValueError('Expected pd.DataFrame or pd.Series.')
 
-    bad_info = jj.sum()
+    # comparisons with NaN are False, so missing INFO values are never flagged
+    with np.errstate(invalid='ignore'):
+        jj = ((x > 2.0) | (x < 0)).any(axis=1)
+        ii = np.nansum(x, axis=1) >= args.info_min * x.shape[1]
+    ii &= ~np.isnan(x).all(axis=1)
+
+    bad_info = np.count_nonzero(jj)
     if bad_info > 0:
         msg = 'WARNING: {N} SNPs had INFO outside of [0,1.5]. The INFO column may be mislabeled.'
         log.log(msg.format(N=bad_info))
 
-    return ii
+    return pd.Series(ii, index=info.index)
 
 
 def filter_frq(frq, log, args):
     '''
     Filter on MAF. Remove MAF < args.maf_min and out-of-bounds MAF.
     '''
-    jj = (frq < 0) | (frq > 1)
-    bad_frq = jj.sum()
+    f = frq.values
+    jj = (f < 0) | (f > 1)
+    bad_frq = np.count_nonzero(jj)
     if bad_frq > 0:
         msg = 'WARNING: {N} SNPs had FRQ outside of [0,1]. The FRQ column may be mislabeled.'
         log.log(msg.format(N=bad_frq))
 
-    frq = np.minimum(frq, 1 - frq)
-    ii = frq > args.maf_min
-    return ii & ~jj
+    ii = np.minimum(f, 1 - f) > args.maf_min
+    ii &= ~jj
+    return pd.Series(ii, index=frq.index)
 
 
 def filter_alleles(a):
-    '''Remove alleles that do not describe strand-unambiguous SNPs'''
-    return a.isin(sumstats.VALID_SNPS)
+    '''Remove alleles that do not describe strand-unambiguous SNPs (case insensitive)'''
+    # two bytes for the allele pair, plus a third that is nonzero for anything longer
+    b = np.asarray(a, dtype='S3').view(np.uint8).reshape(-1, 3)
+    ii = VALID_SNPS_LUT[b[:, 0], b[:, 1]] & (b[:, 2] == 0)
+    return pd.Series(ii, index=a.index)
 
 
 def parse_dat(dat_gen, convert_colname, merge_alleles, log, args):
@@ -242,45 +268,44 @@ def parse_dat(dat_gen, convert_colname, merge_alleles, log, args):
     log.log(msg.format(F=args.sumstats, N=int(args.chunksize)))
     drops = {'NA': 0, 'P': 0, 'INFO': 0,
              'FRQ': 0, 'A': 0, 'SNP': 0, 'MERGE': 0}
+    if args.merge_alleles:
+        # hash the --merge-alleles SNPs once rather than once per chunk
+        merge_snps = pd.Index(merge_alleles.SNP.unique())
+
     for block_num, dat in enumerate(dat_gen):
         sys.stdout.write('.')
         tot_snps += len(dat)
-        old = len(dat)
-        dat = dat.dropna(axis=0, how="any", subset=filter(
-            lambda x: x != 'INFO', dat.columns)).reset_index(drop=True)
-        drops['NA'] += old - len(dat)
-        dat.columns = map(lambda x: convert_colname[x], dat.columns)
+        # missing values and --merge-alleles are checked together, so that the chunk is
+        # only copied once before the remaining filters
+        ii = dat[[x for x in dat.columns if x != 'INFO']].notnull().all(axis=1).values
+        # running count of the SNPs still in ii, so each filter costs one count
+        n = np.count_nonzero(ii)
+        drops['NA'] += len(dat) - n
+        dat.columns = [convert_colname[x] for x in dat.columns]
 
         wrong_types = [c for c in dat.columns if c in numeric_cols and not np.issubdtype(dat[c].dtype, np.number)]
         if len(wrong_types) > 0:
             raise ValueError('Columns {} are expected to be numeric'.format(wrong_types))
 
-        ii = np.array([True for i in xrange(len(dat))])
         if args.merge_alleles:
-            old = ii.sum()
-            ii = dat.SNP.isin(merge_alleles.SNP)
-            drops['MERGE'] += old - ii.sum()
-            if ii.sum() == 0:
-                continue
-
-            dat = dat[ii].reset_index(drop=True)
-            ii = np.array([True for i in xrange(len(dat))])
-
-        if 'INFO' in dat.columns:
-            old = ii.sum()
-            ii &= filter_info(dat['INFO'], log, args)
-            new = ii.sum()
-            drops['INFO'] += old - new
-            old = new
-
-        if 'FRQ' in dat.columns:
-            old = ii.sum()
-            ii &= filter_frq(dat['FRQ'], log, args)
-            new = ii.sum()
-            drops['FRQ'] += old - new
-            old = new
-
-        old = ii.sum()
+            ii &= merge_snps.get_indexer(dat.SNP.values) >= 0
+            new = np.count_nonzero(ii)
+            drops['MERGE'] += n - new
+            n = new
+
+        if n == 0:
+            continue
+
+        dat = dat[ii].reset_index(drop=True)
+        ii = np.ones(len(dat), dtype=bool)
+
+        for c, filter_col in [('INFO', filter_info), ('FRQ', filter_frq)]:
+            if c in dat.columns:
+                ii &= filter_col(dat[c], log, args)
+                new = np.count_nonzero(ii)
+                drops[c] += n - new
+                n = new
+
         if args.keep_maf:
             dat.drop(
                 [x for x in ['INFO'] if x in dat.columns], inplace=True, axis=1)
@@ -288,24 +313,27 @@ def parse_dat(dat_gen, convert_colname, merge_alleles, log, args):
             dat.drop(
                 [x for x in ['INFO', 'FRQ'] if x in dat.columns], inplace=True, axis=1)
         ii &= filter_pvals(dat.P, log, args)
-        new = ii.sum()
-        drops['P'] += old - new
-        old = new
+        new = np.count_nonzero(ii)
+        drops['P'] += n - new
+        n = new
         if not args.no_alleles:
-            dat.A1 = dat.A1.str.upper()
-            dat.A2 = dat.A2.str.upper()
             ii &= filter_alleles(dat.A1 + dat.A2)
-            new = ii.sum()
-            drops['A'] += old - new
-            old = new
+            new = np.count_nonzero(ii)
+            drops['A'] += n - new
+            n = new
 
-        if ii.sum() == 0:
+        if n == 0:
             continue
 
-        dat_list.append(dat[ii].reset_index(drop=True))
+        dat_list.append(dat[ii])
 
     sys.stdout.write(' done\n')
-    dat = pd.concat(dat_list, axis=0).reset_index(drop=True)
+    dat = pd.concat(dat_list, axis=0, ignore_index=True)
+    if not args.no_alleles:
+        # only capitalize the alleles that survived filtering
+        dat.A1 = dat.A1.str.upper()
+        dat.A2 = dat.A2.str.upper()
+
     msg = 'Read {N} SNPs from --sumstats file.\n'.format(N=tot_snps)
     if args.merge_alleles:
         msg += 'Removed {N} SNPs not in --merge-alleles.\n'.format(
@@ -328,14 +356,14 @@ def parse_dat(dat_gen, convert_colname, merge_alleles, log, args):
 def process_n(dat, args, log):
     '''Determine sample size from --N* flags or N* columns. Filter out low N SNPs.s'''
     if all(i in dat.columns for i in ['N_CAS', 'N_CON']):
-        N = dat.N_CAS + dat.N_CON
-        P = dat.N_CAS / N
-        dat['N'] = N * P / P[N == N.max()].mean()
+        N = (dat.N_CAS.values + dat.N_CON.values).astype(float)
+        P = dat.N_CAS.values / N
+        dat['N'] = N * P / P[N == np.nanmax(N)].mean()
         dat.drop(['N_CAS', 'N_CON'], inplace=True, axis=1)
         # NB no filtering on N done here -- that is done in the next code block
 
     if 'N' in dat.columns:
-        n_min = args.n_min if args.n_min else dat.N.quantile(0.9) / 1.5
+        n_min = args.n_min if args.n_min else np.nanpercentile(dat.N.values, 90) / 1.5
         old = len(dat)
         dat = dat[dat.N >= n_min].reset_index(drop=True)
         new = len(dat)
@@ -369,7 +397,14 @@ def process_n(dat, args, log):
 
 def p_to_z(P, N):
     '''Convert P-value and N to standardized beta.'''
-    return np.sqrt(chi2.isf(P, 1))
+    # sqrt(chi2.isf(P, 1)) == |Z| where P = 2 * Phi(-|Z|), but ndtri is much faster.
+    # P / 2 underflows for subnormal P, so those few fall back to chi2.isf.
+    P = np.asarray(P, dtype=float)
+    Z = np.abs(ndtri(P / 2))
+    tiny = P < np.finfo(float).tiny
+    if tiny.any():
+        Z[tiny] = np.sqrt(chi2.isf(P[tiny], 1))
+    return Z
 
 
 def check_median(x, expected_median, tolerance, name):
@@ -400,7 +435,7 @@ def parse_flag_cnames(log, args):
         [args.a1, 'A1', '--a1'],
         [args.a2, 'A2', '--a2'],
         [args.p, 'P', '--P'],
-        [args.frq, 'FRQ', '--nstudy'],
+        [args.frq, 'FRQ', '--frq'],
         [args.info, 'INFO', '--info']
     ]
     flag_cnames = {clean_header(x[0]): x[1]
@@ -433,15 +468,18 @@ def allele_merge(dat, alleles, log):
     WARNING: dat now contains a bunch of NA's~
     Note: dat now has the same SNPs in the same order as --merge alleles.
     '''
-    dat = pd.merge(
-        alleles, dat, how='left', on='SNP', sort=False).reset_index(drop=True)
-    ii = dat.A1.notnull()
+    # SNP is unique in dat after drop_duplicates, so a reindex against the
+    # --merge-alleles order gives the same result as a left merge while hashing
+    # only the sumstats SNPs
+    dat = dat.set_index('SNP').reindex(alleles.SNP).reset_index()
+    dat.insert(1, 'MA', alleles.MA.values)
+    ii = dat.A1.notnull().values
     a1234 = dat.A1[ii] + dat.A2[ii] + dat.MA[ii]
-    match = a1234.apply(lambda y: y in sumstats.MATCH_ALLELES)
-    jj = pd.Series(np.zeros(len(dat), dtype=bool))
+    match = a1234.isin(sumstats.MATCH_ALLELES).values
+    jj = np.zeros(len(dat), dtype=bool)
     jj[ii] = match
-    old = ii.sum()
-    n_mismatch = (~match).sum()
+    old = np.count_nonzero(ii)
+    n_mismatch = old - np.count_nonzero(match)
     if n_mismatch < old:
         log.log('Removed {M} SNPs whose alleles did not match --merge-alleles ({N} SNPs remain).'.format(M=n_mismatch,
                                                                                                          N=old - n_mismatch))
@@ -572,8 +610,8 @@ def munge_sumstats(args, p=True):
         cname_map = get_cname_map(
             flag_cnames, mod_default_cnames, ignore_cnames)
         if args.daner:
-            frq_u = filter(lambda x: x.startswith('FRQ_U_'), file_cnames)[0]
-            frq_a = filter(lambda x: x.startswith('FRQ_A_'), file_cnames)[0]
+            frq_u = [x for x in file_cnames if x.startswith('FRQ_U_')][0]
+            frq_a = [x for x in file_cnames if x.startswith('FRQ_A_')][0]
             N_cas = float(frq_a[6:])
             N_con = float(frq_u[6:])
             log.log(
@@ -588,7 +626,7 @@ def munge_sumstats(args, p=True):
             cname_map[frq_u] = 'FRQ'
 
         if args.daner_n:
-            frq_u = filter(lambda x: x.startswith('FRQ_U_'), file_cnames)[0]
+            frq_u = [x for x in file_cnames if x.startswith('FRQ_U_')][0]
             cname_map[frq_u] = 'FRQ'
             try:
                 dan_cas = clean_header(file_cnames[file_cnames.index('Nca')])
@@ -603,8 +641,9 @@ def munge_sumstats(args, p=True):
                 cname_map[dan_cas] = 'N_CAS'
             cname_map[dan_con] = 'N_CON'
 
-        cname_translation = {x: cname_map[clean_header(x)] for x in file_cnames if
-                             clean_header(x) in cname_map}  # note keys not cleaned
+        clean_file_cnames = {x: clean_header(x) for x in file_cnames}
+        cname_translation = {x: cname_map[clean_file_cnames[x]] for x in file_cnames if
+                             clean_file_cnames[x] in cname_map}  # note keys not cleaned
         cname_description = {
             x: describe_cname[cname_translation[x]] for x in cname_translation}
         if args.signed_sumstats is None and not args.a1_inc:
@@ -674,7 +713,7 @@ def munge_sumstats(args, p=True):
             log.log(
                 'Read {N} SNPs for allele merge.'.format(N=len(merge_alleles)))
             merge_alleles['MA'] = (
-                merge_alleles.A1 + merge_alleles.A2).apply(lambda y: y.upper())
+                merge_alleles.A1 + merge_alleles.A2).str.upper()
             merge_alleles.drop(
                 [x for x in merge_alleles.columns if x not in ['SNP', 'MA']], axis=1, inplace=True)
         else:
@@ -706,7 +745,8 @@ def munge_sumstats(args, p=True):
         if not args.a1_inc:
             log.log(
                 check_median(dat.SIGNED_SUMSTAT, signed_sumstat_null, 0.1, sign_cname))
-            dat.Z *= (-1) ** (dat.SIGNED_SUMSTAT < signed_sumstat_null)
+            flip = dat.SIGNED_SUMSTAT.values < signed_sumstat_null
+            dat.Z = np.where(flip, -dat.Z.values, dat.Z.values)
             dat.drop('SIGNED_SUMSTAT', inplace=True, axis=1)
         # do this last so we don't have to worry about NA values in the rest of
         # the program
@@ -718,25 +758,36 @@ def munge_sumstats(args, p=True):
             c for c in dat.columns if c in ['SNP', 'N', 'Z', 'A1', 'A2']]
         if args.keep_maf and 'FRQ' in dat.columns:
             print_colnames.append('FRQ')
+        # --merge-alleles leaves N and Z missing for some SNPs; drop those once, for the
+        # count here and for every summary in the metadata below
+        CHISQ = dat.Z.values ** 2
+        CHISQ = CHISQ[~np.isnan(CHISQ)]
         msg = 'Writing summary statistics for {M} SNPs ({N} with nonmissing beta) to {F}.'
         log.log(
-            msg.format(M=len(dat), F=out_fname + '.gz', N=dat.N.notnull().sum()))
+            msg.format(M=len(dat), F=out_fname + '.gz', N=len(CHISQ)))
         if p:
-            dat.to_csv(out_fname, sep="\t", index=False,
-                       columns=print_colnames, float_format='%.3f')
-            os.system('gzip -f {F}'.format(F=out_fname))
+            ps.write_gzip_csv(dat, out_fname + '.gz', sep="\t", index=False,
+                              columns=print_colnames, float_format='%.3f')
 
         log.log('\nMetadata:')
-        CHISQ = (dat.Z ** 2)
-        mean_chisq = CHISQ.mean()
+        n = len(CHISQ)
+        # with no SNPs left every summary is nan, as it was for the empty Series
+        mean_chisq = CHISQ.mean() if n > 0 else float('nan')
         log.log('Mean chi^2 = ' + str(round(mean_chisq, 3)))
         if mean_chisq < 1.02:
             log.log("WARNING: mean chi^2 may be too small.")
 
-        log.log('Lambda GC = ' + str(round(CHISQ.median() / 0.4549, 3)))
-        log.log('Max chi^2 = ' + str(round(CHISQ.max(), 3)))
-        log.log('{N} Genome-wide significant SNPs (some may have been removed by filtering).'.format(N=(CHISQ
-                                                                                                        > 29).sum()))
+        if n > 0:
+            # a single selection gives both middle order statistics and the maximum
+            CHISQ = np.partition(CHISQ, [(n - 1) // 2, n // 2, n - 1])
+            median_chisq = (CHISQ[(n - 1) // 2] + CHISQ[n // 2]) / 2
+            max_chisq = CHISQ[n - 1]
+        else:
+            median_chisq = max_chisq = float('nan')
+        log.log('Lambda GC = ' + str(round(median_chisq / 0.4549, 3)))
+        log.log('Max chi^2 = ' + str(round(max_chisq, 3)))
+        log.log('{N} Genome-wide significant SNPs (some may have been removed by filtering).'.format(
+            N=np.count_nonzero(CHISQ > 29)))
         return dat
 
     except Exception:
@@ -4,8 +4,10 @@ import unittest
 import numpy as np
 import pandas as pd
 import nose
+from nose.tools import assert_equal
 from pandas.util.testing import assert_series_equal
 from pandas.util.testing import assert_frame_equal
+from scipy.stats import chi2
 from numpy.testing import assert_array_equal, assert_array_almost_equal, assert_allclose
 
 
@@ -35,6 +37,11 @@ class test_p_to_z(unittest.TestCase):
     def test_p_to_z(self):
         assert_allclose(munge.p_to_z(self.P, self.N), self.Z, atol=1e-5)
 
+    def test_p_to_z_subnormal(self):
+        P = pd.Series([5e-324, 1e-310, 1e-300])
+        Z = np.sqrt(chi2.isf(P, 1))
+        assert_allclose(munge.p_to_z(P, self.N), Z, rtol=1e-6)
+
 
 class test_check_median(unittest.TestCase):
 
@@ -89,6 +96,13 @@ class test_process_n(unittest.TestCase):
         dat = munge.process_n(self.dat, self.args, log)
         assert_frame_equal(dat, self.dat_filtered)
 
+    def test_n_cas_con_zero(self):
+        # N_CAS = N_CON = 0 gives N = NaN, which should drop only that SNP
+        self.dat['N_CAS'] = [0.0, 617, 617]
+        self.dat['N_CON'] = [0.0, 617, 617]
+        dat = munge.process_n(self.dat, self.args, log)
+        assert_frame_equal(dat, self.dat_filtered)
+
     def test_n_flag(self):
         self.args.N = 1234.0
         self.args.N_cas = None
@@ -140,6 +154,12 @@ def test_filter_alleles():
     assert_series_equal(x, y)
 
 
+def test_filter_alleles_lowercase():
+    a = pd.Series(['ac', 'Ag', 'at', 'di'])
+    x = munge.filter_alleles(a)
+    assert_series_equal(x, pd.Series([True, True, False, False]))
+
+
 class test_allele_merge(unittest.TestCase):
 
     def setUp(self):
@@ -212,6 +232,12 @@ class test_parse_dat(unittest.TestCase):
             self.dat_gen, self.convert_colname, None, log, self.args)
         assert_frame_equal(dat, self.dat.drop(['INFO', 'FRQ'], axis=1))
 
+    def test_lowercase_alleles(self):
+        self.dat_gen[1]['A1'] = 'a'
+        dat = munge.parse_dat(
+            self.dat_gen, self.convert_colname, None, log, self.args)
+        assert_frame_equal(dat, self.dat.drop(['INFO', 'FRQ'], axis=1))
+
     def test_na(self):
         self.dat.loc[0, 'SNP'] = float('NaN')
         self.dat.loc[1, 'A2'] = float('NaN')
@@ -222,6 +248,13 @@ class test_parse_dat(unittest.TestCase):
         assert_frame_equal(
             dat, self.dat.loc[2:, ['SNP', 'A1', 'A2', 'P']].reset_index(drop=True))
 
+    def test_non_numeric_p(self):
+        self.dat['P'] = 'foo'
+        self.dat_gen = [
+            self.dat.loc[0:4, :], self.dat.loc[5:9, :].reset_index(drop=True)]
+        nose.tools.assert_raises(
+            ValueError, munge.parse_dat, self.dat_gen, self.convert_colname, None, log, self.args)
+
 
 def test_clean_header():
     nose.tools.eq_(munge.clean_header('foo-bar.foo_BaR'), 'FOO_BAR_FOO_BAR')
@@ -326,6 +359,23 @@ class test_end_to_end(unittest.TestCase):
             'test/munge_test/correct_merge.sumstats', delim_whitespace=True, header=0)
         assert_frame_equal(x, correct)
 
+    def test_merge_alleles_exact(self):
+        # every SNP is in --merge-alleles with matching alleles, so no rows are blanked
+        self.args.sumstats = 'test/munge_test/sumstats_int_n'
+        self.args.merge_alleles = 'test/munge_test/merge_alleles_exact'
+        self.args.daner = False
+        x = munge.munge_sumstats(self.args, p=False)
+        correct = pd.read_csv(
+            'test/munge_test/correct_merge_exact.sumstats', delim_whitespace=True, header=0)
+        assert_frame_equal(x, correct, check_less_precise=True)
+
+    def test_n_min_drops_all(self):
+        self.args.sumstats = 'test/munge_test/sumstats_int_n'
+        self.args.daner = False
+        self.args.n_min = 1e9
+        x = munge.munge_sumstats(self.args, p=False)
+        assert_equal(len(x), 0)
+
     def test_bad_merge_alleles(self):
         self.args.merge_alleles = 'test/munge_test/merge_alleles_bad'
         nose.tools.assert_raises(
@@ -1,16 +1,29 @@
 from __future__ import division
 from ldscore import parse as ps
+import ldsc
 import unittest
 import numpy as np
 import pandas as pd
 import nose
 import os
+import gzip
+import shutil
+import tempfile
 from nose.tools import *
 from numpy.testing import assert_array_equal, assert_array_almost_equal
 
 DIR = os.path.dirname(__file__)
 
 
+class Mock(object):
+    '''
+    Dumb object for mocking log
+    '''
+
+    def log(self, x):
+        pass
+
+
 def test_series_eq():
     x = pd.Series([1, 2, 3])
     y = pd.Series([1, 2])
@@ -54,6 +67,42 @@ def test_frq_parser():
     assert_array_equal(x.FRQ, [.01, .1, .3, .2, .2, .2, .01, .03])
 
 
+class Test_write_gzip_csv(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.fh = os.path.join(self.tmp, 'test.gz')
+        self.df = pd.DataFrame({'SNP': ['rs1', 'rs2'], 'L2': [1.25, 2.5]}, columns=['SNP', 'L2'])
+        self.find_executable = ps.find_executable
+
+    def tearDown(self):
+        ps.find_executable = self.find_executable
+        shutil.rmtree(self.tmp)
+
+    def write(self):
+        ps.write_gzip_csv(self.df, self.fh, sep='\t', index=False, float_format='%.3f')
+        with gzip.open(self.fh) as f:
+            return f.read()
+
+    def test_gzip(self):
+        ps.find_executable = lambda name: None
+        assert_equal(self.write(), 'SNP\tL2\nrs1\t1.250\nrs2\t2.500\n')
+
+    def test_pigz(self):
+        # gzip takes the same -6 -c arguments, so it can stand in for pigz
+        gzip_exe = self.find_executable('gzip')
+        ps.find_executable = lambda name: gzip_exe
+        assert_equal(self.write(), 'SNP\tL2\nrs1\t1.250\nrs2\t2.500\n')
+
+    def test_pigz_error(self):
+        fake_pigz = os.path.join(self.tmp, 'pigz')
+        with open(fake_pigz, 'w') as f:
+            f.write('#!/bin/sh\ncat > /dev/null\nexit 3\n')
+        os.chmod(fake_pigz, 0755)
+        ps.find_executable = lambda name: fake_pigz
+        assert_raises(IOError, self.write)
+
+
 class Test_ldscore(unittest.TestCase):
 
     def test_ldscore(self):
@@ -68,6 +117,30 @@ class Test_ldscore(unittest.TestCase):
         assert_equal(list(x['AL2']), range(1, 3))
         assert_equal(list(x['BL2']), range(2, 6, 2))
 
+    def test_ldscore_pickle(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            log = Mock()
+            out = os.path.join(tmp, 'test')
+            args = ldsc.parser.parse_args(['--l2', '--bfile', os.path.join(DIR, 'plink_test/plink'),
+                                           '--ld-wind-snps', '3', '--out', out])
+            ldsc.ldscore(args, log)
+            args.out = out + '_pickle'
+            args.pickle = True
+            ldsc.ldscore(args, log)
+            assert_true(os.path.exists(args.out + '.l2.ldscore.pickle.gz'))
+            # pickles are only read when asked for
+            assert_raises(IOError, ps.ldscore, args.out)
+            x = ps.ldscore(args.out, pickle=True)
+            y = ps.ldscore(out)
+            assert_array_equal(x.SNP, y.SNP)
+            assert_equal(x.L2.dtype, np.float64)
+            assert_array_almost_equal(x.L2, y.L2, decimal=3)
+            # the gzip compression is inferred from the suffix
+            assert_array_equal(pd.read_pickle(args.out + '.l2.ldscore.pickle.gz').SNP, y.SNP)
+        finally:
+            shutil.rmtree(tmp)
+
     def test_ldscore_fromlist(self):
         fh = os.path.join(DIR, 'parse_test/test')
         x = ps.ldscore_fromlist([fh, fh])